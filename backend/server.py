@@ -1,41 +1,202 @@
 from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
 from datetime import datetime, timezone
 import asyncio
-from groq import Groq
+from groq import AsyncGroq
 from sentence_transformers import SentenceTransformer
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-import json
+import simsimd
+import orjson
+import re
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, maxPoolSize=100, minPoolSize=10, maxIdleTimeMS=60000)
 db = client[os.environ['DB_NAME']]
 
-# Initialize Groq client
-groq_client = Groq(api_key=os.environ['GROQ_API_KEY'])
+# Initialize Groq client (async, so LLM calls never hold an executor thread)
+groq_client = AsyncGroq(api_key=os.environ['GROQ_API_KEY'])
 
-# Initialize embedding model (lightweight for faster performance)
+# Initialize embedding model (lightweight for faster performance). The ONNX
+# backend runs inference on onnxruntime's fused CPU kernels; set
+# EMBEDDING_BACKEND=torch to use PyTorch instead.
 embedding_model = None
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'onnx')
 
 def get_embedding_model():
     global embedding_model
     if embedding_model is None:
-        embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        embedding_model = SentenceTransformer('all-MiniLM-L6-v2', backend=EMBEDDING_BACKEND)
     return embedding_model
 
+# Rank KB articles on int8-quantized embeddings; set to false to use the
+# float32 matrix instead (e.g. to compare retrieval quality)
+RAG_INT8_RETRIEVAL = os.environ.get('RAG_INT8_RETRIEVAL', 'true').lower() == 'true'
+
+def quantize_int8(vectors: np.ndarray) -> np.ndarray:
+    """Scale each vector so its largest component maps to +/-127 and round to int8.
+
+    The per-vector scale is not kept: cosine similarity is scale-invariant.
+    """
+    scale = 127.0 / np.maximum(np.abs(vectors).max(axis=-1, keepdims=True), 1e-12)
+    return np.round(vectors * scale).astype(np.int8)
+
+# In-memory KB cache: L2-normalized float32 embedding matrix (one row per
+# article), its int8-quantized copy, and parallel article metadata, so RAG
+# queries skip the Mongo round-trip and similarity reduces to a dot product
+_kb_cache = {"matrix": None, "matrix_i8": None, "meta": None}
+# Held while loading the cache and around KB writes + cache updates, so an
+# article inserted during a cold load is neither missed nor appended twice
+_kb_cache_lock = asyncio.Lock()
+
+def invalidate_kb_cache():
+    _kb_cache["matrix"] = None
+    _kb_cache["matrix_i8"] = None
+    _kb_cache["meta"] = None
+
+async def get_kb_cache():
+    """Return (matrix, matrix_i8, meta) for the KB, loading it from Mongo on first use"""
+    async with _kb_cache_lock:
+        if _kb_cache["matrix"] is None:
+            # Load only the fields used for retrieval and answers
+            projection = {"_id": 0, "article_id": 1, "title": 1, "content": 1, "category": 1, "embedding": 1}
+            articles = await db.kb_articles.find({}, projection).to_list(None)
+            if not articles:
+                return None, None, []
+            matrix = np.ascontiguousarray(
+                [article.pop('embedding') for article in articles], dtype=np.float32
+            )
+            # Articles stored before embeddings were normalized at insert time
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            _kb_cache["matrix"] = matrix
+            _kb_cache["matrix_i8"] = quantize_int8(matrix)
+            _kb_cache["meta"] = articles
+        return _kb_cache["matrix"], _kb_cache["matrix_i8"], _kb_cache["meta"]
+
+def append_kb_cache(article_dict: Dict[str, Any]):
+    """Append a newly inserted article to the cache if it is already loaded.
+
+    Call with _kb_cache_lock held, together with the insert itself.
+    """
+    if _kb_cache["matrix"] is None:
+        return
+    row = np.asarray(article_dict['embedding'], dtype=np.float32).reshape(1, -1)
+    _kb_cache["matrix"] = np.vstack([_kb_cache["matrix"], row])
+    _kb_cache["matrix_i8"] = np.vstack([_kb_cache["matrix_i8"], quantize_int8(row)])
+    _kb_cache["meta"].append({k: v for k, v in article_dict.items() if k not in ('embedding', '_id')})
+
+class SemanticCache:
+    """In-memory cache of LLM responses keyed by request embedding.
+
+    Entries are grouped by namespace (customer, prompt version, ...) so a hit
+    never crosses customers or prompts. A lookup returns the stored response
+    of the most similar previous request if its cosine similarity reaches
+    the threshold.
+
+    Each namespace has a generation that invalidate() bumps. Callers read it
+    before building a prompt and pass it to insert(), so an answer computed
+    from data invalidated mid-request is dropped instead of cached.
+    """
+
+    def __init__(self, threshold: float = 0.97, max_entries: int = 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+
+    def generation(self, namespace: str) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(namespace, 0)
+
+    def lookup(self, namespace: str, embedding: np.ndarray) -> Optional[Any]:
+        entry = self._entries.get(namespace)
+        if entry is None:
+            return None
+        scores = entry["matrix"] @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return entry["values"][best]
+        return None
+
+    def insert(self, namespace: str, embedding: np.ndarray, value: Any, generation: Tuple[int, int]):
+        if generation != self.generation(namespace):
+            return
+        row = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        entry = self._entries.get(namespace)
+        if entry is None:
+            self._entries[namespace] = {"matrix": row, "values": [value]}
+            return
+        # Drop the oldest entries once the namespace is full
+        start = max(0, len(entry["values"]) + 1 - self.max_entries)
+        entry["matrix"] = np.vstack([entry["matrix"][start:], row])
+        entry["values"] = entry["values"][start:] + [value]
+
+    def invalidate(self, namespace: Optional[str] = None):
+        if namespace is None:
+            self._entries.clear()
+            self._epoch += 1
+        else:
+            self._entries.pop(namespace, None)
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+llm_cache = SemanticCache()
+
+async def embed_text(text: str) -> np.ndarray:
+    """Embed text as a unit-norm, C-contiguous 1-D float32 vector"""
+    embedding = await asyncio.to_thread(
+        get_embedding_model().encode, text, normalize_embeddings=True, convert_to_numpy=True
+    )
+    return np.ascontiguousarray(embedding, dtype=np.float32)
+
+async def embed_cache_key(text: str) -> np.ndarray:
+    """Embed whitespace/case-normalized request text for semantic cache lookups"""
+    return await embed_text(" ".join(text.split()).lower())
+
+# Extracts the JSON object from an LLM response
+JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+def parse_llm_json(response_text: str) -> Dict[str, Any]:
+    """Extract and parse the JSON object from an LLM response"""
+    json_match = JSON_RE.search(response_text)
+    if not json_match:
+        raise HTTPException(status_code=500, detail="Failed to parse LLM response")
+    return orjson.loads(json_match.group())
+
+async def stream_completion(messages: List[Dict[str, str]], temperature: float, max_tokens: int):
+    """Yield content deltas of a streaming Groq completion"""
+    stream = await groq_client.chat.completions.create(
+        model="llama-3.3-70b-versatile",
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True
+    )
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Release the upstream response if the client disconnects or parsing fails
+        await stream.close()
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> bytes:
+    """Format a server-sent event with a JSON payload"""
+    prefix = f"event: {event}\n".encode() if event else b""
+    return prefix + b"data: " + orjson.dumps(data) + b"\n\n"
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -103,8 +264,24 @@ async def add_emails_bulk(emails: List[Email]):
     """Add multiple emails to the database"""
     try:
         emails_data = [email.model_dump() for email in emails]
-        result = await db.emails.insert_many(emails_data)
-        return {"message": f"Added {len(result.inserted_ids)} emails", "count": len(result.inserted_ids)}
+        skipped = set()
+        try:
+            await db.emails.insert_many(emails_data, ordered=False, bypass_document_validation=True)
+        except BulkWriteError as e:
+            # Emails whose email_id already exists are skipped; report the rest
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            skipped = {error["index"] for error in e.details["writeErrors"]}
+        inserted = len(emails_data) - len(skipped)
+        # Only customers that actually got new emails have new tags
+        written_customers = {email.customer_id for i, email in enumerate(emails) if i not in skipped}
+        for customer_id in written_customers:
+            llm_cache.invalidate(f"tag:{customer_id}")
+        return {
+            "message": f"Added {inserted} emails",
+            "count": inserted,
+            "duplicates": len(skipped)
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -122,79 +299,107 @@ async def get_emails(customer_id: Optional[str] = None):
 async def get_customers():
     """Get list of unique customer IDs"""
     try:
-        customers = await db.emails.distinct("customer_id")
-        return {"customers": sorted(customers)}
+        # Leading $match/$sort on customer_id lets $group use a DISTINCT_SCAN
+        # of the customer_id index instead of scanning the collection
+        cursor = db.emails.aggregate([
+            {"$match": {"customer_id": {"$ne": None}}},
+            {"$sort": {"customer_id": 1}},
+            {"$group": {"_id": "$customer_id"}},
+            {"$sort": {"_id": 1}}
+        ])
+        customers = [doc["_id"] async for doc in cursor]
+        return {"customers": customers}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 async def get_customer_tags(customer_id: str) -> List[str]:
     """Get all unique tags for a specific customer (ensures customer isolation)"""
-    emails = await db.emails.find({"customer_id": customer_id}, {"tag": 1, "_id": 0}).to_list(1000)
-    tags = list(set([email.get("tag") for email in emails if email.get("tag")]))
-    return tags
+    return await db.emails.distinct("tag", {"customer_id": customer_id, "tag": {"$nin": [None, ""]}})
 
 async def get_customer_patterns(customer_id: str) -> Dict[str, List[Pattern]]:
     """Get patterns and anti-patterns for a customer"""
-    patterns_data = await db.patterns.find({"customer_id": customer_id}, {"_id": 0}).to_list(100)
-    patterns = [Pattern(**p) for p in patterns_data]
+    patterns_data, anti_patterns_data = await asyncio.gather(
+        db.patterns.find({"customer_id": customer_id, "pattern_type": "pattern"}, {"_id": 0}).to_list(100),
+        db.patterns.find({"customer_id": customer_id, "pattern_type": "anti_pattern"}, {"_id": 0}).to_list(100)
+    )
     
     result = {
-        "patterns": [p for p in patterns if p.pattern_type == "pattern"],
-        "anti_patterns": [p for p in patterns if p.pattern_type == "anti_pattern"]
+        "patterns": [Pattern(**p) for p in patterns_data],
+        "anti_patterns": [Pattern(**p) for p in anti_patterns_data]
     }
     return result
 
-@api_router.post("/tag/predict", response_model=TagResponse)
-async def predict_tag(request: TagRequest):
-    """Predict tag for an email with customer isolation"""
-    try:
-        # Get customer-specific tags (CUSTOMER ISOLATION)
-        available_tags = await get_customer_tags(request.customer_id)
-        
-        if not available_tags:
-            raise HTTPException(status_code=400, detail="No tags found for this customer. Please add training data first.")
-        
-        # Get customer patterns
-        patterns = await get_customer_patterns(request.customer_id)
-        
-        # Build prompt with patterns and anti-patterns
-        pattern_text = ""
-        if patterns["patterns"]:
-            pattern_text += "\n\nPatterns (signals that help identify tags):\n"
-            for p in patterns["patterns"]:
-                pattern_text += f"- {p.description}. Keywords: {', '.join(p.keywords)}. Tag: {p.target_tag}\n"
-        
-        if patterns["anti_patterns"]:
-            pattern_text += "\n\nAnti-patterns (common mistakes to avoid):\n"
-            for p in patterns["anti_patterns"]:
-                pattern_text += f"- {p.description}. Misleading keywords: {', '.join(p.keywords)}\n"
-        
-        prompt = f"""You are an email classification system for customer support emails.
-
-Customer ID: {request.customer_id}
-Available tags for THIS customer ONLY: {', '.join(available_tags)}
-{pattern_text}
-
-Email to classify:
-Subject: {request.subject}
-Body: {request.body}
+# Static instructions go first as the system message so every tagging
+# request shares an identical prompt prefix (cacheable by the provider);
+# only the customer context and email vary in the user message.
+SYS_TAG_PROMPT = """You are an email classification system for customer support emails.
 
 Rules:
-1. You MUST choose ONLY from the available tags listed above
+1. You MUST choose ONLY from the available tags listed for the customer
 2. Consider the patterns and anti-patterns to improve accuracy
 3. Analyze the core issue, not just keywords
 4. Provide confidence score (0.0-1.0)
 
 Respond in JSON format:
-{{
+{
   "predicted_tag": "<tag from available list>",
   "confidence": <0.0-1.0>,
   "reasoning": "<brief explanation>"
-}}"""
+}"""
+
+async def build_tag_messages(request: TagRequest) -> List[Dict[str, str]]:
+    """Build the tagging chat messages from the customer's own tags and patterns"""
+    # Get customer-specific tags (CUSTOMER ISOLATION)
+    available_tags = await get_customer_tags(request.customer_id)
+    
+    if not available_tags:
+        raise HTTPException(status_code=400, detail="No tags found for this customer. Please add training data first.")
+    
+    # Get customer patterns
+    patterns = await get_customer_patterns(request.customer_id)
+    
+    # Build prompt with patterns and anti-patterns
+    pattern_text = ""
+    if patterns["patterns"]:
+        pattern_text += "\n\nPatterns (signals that help identify tags):\n"
+        for p in patterns["patterns"]:
+            pattern_text += f"- {p.description}. Keywords: {', '.join(p.keywords)}. Tag: {p.target_tag}\n"
+    
+    if patterns["anti_patterns"]:
+        pattern_text += "\n\nAnti-patterns (common mistakes to avoid):\n"
+        for p in patterns["anti_patterns"]:
+            pattern_text += f"- {p.description}. Misleading keywords: {', '.join(p.keywords)}\n"
+    
+    user_prompt = f"""Customer ID: {request.customer_id}
+Available tags for THIS customer ONLY: {', '.join(available_tags)}
+{pattern_text}
+
+Email to classify:
+Subject: {request.subject}
+Body: {request.body}"""
+    
+    return [
+        {"role": "system", "content": SYS_TAG_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+@api_router.post("/tag/predict", response_model=TagResponse)
+async def predict_tag(request: TagRequest):
+    """Predict tag for an email with customer isolation"""
+    try:
+        # Serve near-identical emails for this customer from the cache
+        cache_namespace = f"tag:{request.customer_id}"
+        cache_key = await embed_cache_key(f"{request.subject}\n{request.body}")
+        cached = llm_cache.lookup(cache_namespace, cache_key)
+        generation = llm_cache.generation(cache_namespace)
+        if cached is not None:
+            return cached
         
-        completion = groq_client.chat.completions.create(
+        messages = await build_tag_messages(request)
+        
+        completion = await groq_client.chat.completions.create(
             model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
+            messages=messages,
             temperature=0.3,
             max_tokens=300
         )
@@ -202,23 +407,54 @@ Respond in JSON format:
         response_text = completion.choices[0].message.content
         
         # Parse JSON response
-        import re
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            return TagResponse(**result)
-        else:
-            raise HTTPException(status_code=500, detail="Failed to parse LLM response")
+        response = TagResponse(**parse_llm_json(response_text))
+        llm_cache.insert(cache_namespace, cache_key, response, generation)
+        return response
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/tag/predict/stream")
+async def predict_tag_stream(request: TagRequest):
+    """Predict tag for an email, streaming LLM tokens as server-sent events.
+
+    Emits a "delta" data event per token chunk, then a "result" event with
+    the parsed TagResponse (or an "error" event if parsing fails).
+    """
+    try:
+        cache_namespace = f"tag:{request.customer_id}"
+        cache_key = await embed_cache_key(f"{request.subject}\n{request.body}")
+        cached = llm_cache.lookup(cache_namespace, cache_key)
+        generation = llm_cache.generation(cache_namespace)
+        messages = None if cached is not None else await build_tag_messages(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        if cached is not None:
+            yield sse_event(cached.model_dump(), event="result")
+            return
+        try:
+            chunks = []
+            async for delta in stream_completion(messages, temperature=0.3, max_tokens=300):
+                chunks.append(delta)
+                yield sse_event({"delta": delta})
+            response = TagResponse(**parse_llm_json("".join(chunks)))
+        except Exception as e:
+            yield sse_event({"detail": getattr(e, "detail", str(e))}, event="error")
+            return
+        llm_cache.insert(cache_namespace, cache_key, response, generation)
+        yield sse_event(response.model_dump(), event="result")
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @api_router.post("/patterns")
 async def add_pattern(pattern: Pattern):
     """Add a pattern or anti-pattern for improving tagging accuracy"""
     try:
         pattern_dict = pattern.model_dump()
         await db.patterns.insert_one(pattern_dict)
+        llm_cache.invalidate(f"tag:{pattern.customer_id}")
         return {"message": "Pattern added successfully", "pattern": pattern_dict}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -234,14 +470,9 @@ async def get_patterns(customer_id: str):
 
 # ==================== PART B: SENTIMENT ANALYSIS ====================
 
-@api_router.post("/sentiment/analyze", response_model=SentimentResponse)
-async def analyze_sentiment(request: SentimentRequest, version: int = 1):
-    """Analyze sentiment of email text"""
-    try:
-        if version == 1:
-            prompt = f"""Analyze the sentiment of this customer support email.
-
-Email: {request.email_text}
+# Static system prompts per version; only the email goes in the user message
+SYS_SENTIMENT_PROMPTS = {
+    1: """Analyze the sentiment of this customer support email.
 
 Provide:
 1. Sentiment: positive, negative, or neutral
@@ -249,15 +480,13 @@ Provide:
 3. Brief reasoning
 
 Respond in JSON format:
-{{
+{
   "sentiment": "<positive/negative/neutral>",
   "confidence": <0.0-1.0>,
   "reasoning": "<brief explanation>"
-}}"""
-        else:  # version 2 - improved
-            prompt = f"""You are a sentiment analysis expert for customer support emails.
-
-Email: {request.email_text}
+}""",
+    # version 2 - improved
+    2: """You are a sentiment analysis expert for customer support emails.
 
 Analyze sentiment considering:
 1. Explicit emotion words (frustrated, happy, confused)
@@ -271,15 +500,32 @@ Rules:
 - NEUTRAL: Factual issue reports, setup questions, informational queries
 
 Respond in JSON format:
-{{
+{
   "sentiment": "<positive/negative/neutral>",
   "confidence": <0.0-1.0>,
   "reasoning": "<explain which signals led to this classification>"
-}}"""
+}"""
+}
+
+@api_router.post("/sentiment/analyze", response_model=SentimentResponse)
+async def analyze_sentiment(request: SentimentRequest, version: int = 1):
+    """Analyze sentiment of email text"""
+    try:
+        cache_namespace = f"sentiment:v{version}"
+        cache_key = await embed_cache_key(request.email_text)
+        cached = llm_cache.lookup(cache_namespace, cache_key)
+        generation = llm_cache.generation(cache_namespace)
+        if cached is not None:
+            return cached
         
-        completion = groq_client.chat.completions.create(
+        system_prompt = SYS_SENTIMENT_PROMPTS[1 if version == 1 else 2]
+        
+        completion = await groq_client.chat.completions.create(
             model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Email: {request.email_text}"}
+            ],
             temperature=0.2,
             max_tokens=300
         )
@@ -287,24 +533,32 @@ Respond in JSON format:
         response_text = completion.choices[0].message.content
         
         # Parse JSON response
-        import re
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            return SentimentResponse(**result)
-        else:
-            raise HTTPException(status_code=500, detail="Failed to parse LLM response")
+        response = SentimentResponse(**parse_llm_json(response_text))
+        llm_cache.insert(cache_namespace, cache_key, response, generation)
+        return response
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Max concurrent sentiment analyses per batch, to stay under Groq rate limits
+SENTIMENT_BATCH_CONCURRENCY = 6
+
 @api_router.post("/sentiment/test-batch")
 async def test_sentiment_batch(emails: List[str], version: int = 1):
     """Test sentiment analysis on a batch of emails"""
     try:
+        # Analyze unique emails concurrently (bounded) so LLM round-trips overlap
+        semaphore = asyncio.Semaphore(SENTIMENT_BATCH_CONCURRENCY)
+        
+        async def analyze(email_text: str) -> SentimentResponse:
+            async with semaphore:
+                return await analyze_sentiment(SentimentRequest(email_text=email_text), version)
+        
+        unique_emails = list(dict.fromkeys(emails))
+        responses = dict(zip(unique_emails, await asyncio.gather(*(analyze(e) for e in unique_emails))))
         results = []
         for email_text in emails:
-            result = await analyze_sentiment(SentimentRequest(email_text=email_text), version)
+            result = responses[email_text]
             results.append({
                 "email": email_text[:100] + "..." if len(email_text) > 100 else email_text,
                 "sentiment": result.sentiment,
@@ -324,12 +578,14 @@ async def add_kb_article(article: KBArticle):
         article_dict = article.model_dump()
         
         # Generate embedding for the article
-        model = get_embedding_model()
         text_to_embed = f"{article.title}. {article.content}"
-        embedding = model.encode(text_to_embed).tolist()
+        embedding = (await embed_text(text_to_embed)).tolist()
         article_dict['embedding'] = embedding
         
-        await db.kb_articles.insert_one(article_dict)
+        async with _kb_cache_lock:
+            await db.kb_articles.insert_one(article_dict)
+            append_kb_cache(article_dict)
+        llm_cache.invalidate("rag")
         return {"message": "Article added successfully", "article_id": article.article_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -343,47 +599,49 @@ async def get_kb_articles():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/rag/query", response_model=RAGResponse)
-async def rag_query(request: RAGQuery):
-    """Query the knowledge base using RAG"""
-    try:
-        # Generate query embedding
-        model = get_embedding_model()
-        query_embedding = model.encode(request.query)
-        
-        # Retrieve all articles with embeddings
-        articles = await db.kb_articles.find({}, {"_id": 0}).to_list(100)
-        
-        if not articles:
-            raise HTTPException(status_code=400, detail="No KB articles found. Please add articles first.")
-        
-        # Calculate similarities
-        article_embeddings = np.array([article['embedding'] for article in articles])
-        similarities = cosine_similarity([query_embedding], article_embeddings)[0]
-        
-        # Get top 3 most relevant articles
-        top_indices = np.argsort(similarities)[::-1][:3]
-        retrieved_articles = []
-        
-        for idx in top_indices:
-            article = articles[idx]
-            retrieved_articles.append({
-                "article_id": article['article_id'],
-                "title": article['title'],
-                "content": article['content'],
-                "category": article['category'],
-                "similarity_score": float(similarities[idx])
-            })
-        
-        # Generate answer using Groq with retrieved context
-        context = "\n\n".join([
-            f"Article: {art['title']}\nContent: {art['content']}"
-            for art in retrieved_articles
-        ])
-        
-        prompt = f"""You are a helpful support assistant. Answer the user's question based on the provided knowledge base articles.
+async def retrieve_kb_articles(query_embedding: np.ndarray) -> List[Dict[str, Any]]:
+    """Return the top 3 KB articles most similar to the query embedding"""
+    # Retrieve cached article embeddings
+    article_embeddings, article_embeddings_i8, articles = await get_kb_cache()
+    
+    if not articles:
+        raise HTTPException(status_code=400, detail="No KB articles found. Please add articles first.")
+    
+    # Calculate similarities
+    if RAG_INT8_RETRIEVAL:
+        query_i8 = quantize_int8(query_embedding[np.newaxis])
+        similarities = 1 - np.asarray(simsimd.cdist(query_i8, article_embeddings_i8, metric="cosine"))[0]
+    else:
+        # Embeddings are unit vectors, so cosine == dot
+        similarities = article_embeddings @ query_embedding
+    
+    # Get top 3 most relevant articles
+    top_k = min(3, len(similarities))
+    candidates = np.argpartition(-similarities, top_k - 1)[:top_k]
+    top_indices = candidates[np.argsort(-similarities[candidates])]
+    retrieved_articles = []
+    
+    for idx in top_indices:
+        article = articles[idx]
+        retrieved_articles.append({
+            "article_id": article['article_id'],
+            "title": article['title'],
+            "content": article['content'],
+            "category": article['category'],
+            "similarity_score": float(similarities[idx])
+        })
+    return retrieved_articles
+
+def build_rag_prompt(query: str, retrieved_articles: List[Dict[str, Any]]) -> str:
+    """Build the answer-generation prompt from the retrieved articles"""
+    context = "\n\n".join([
+        f"Article: {art['title']}\nContent: {art['content']}"
+        for art in retrieved_articles
+    ])
+    
+    return f"""You are a helpful support assistant. Answer the user's question based on the provided knowledge base articles.
 
-Question: {request.query}
+Question: {query}
 
 Relevant KB Articles:
 {context}
@@ -397,8 +655,26 @@ Respond in JSON format:
   "answer": "<your detailed answer>",
   "confidence": <0.0-1.0>
 }}"""
+
+@api_router.post("/rag/query", response_model=RAGResponse)
+async def rag_query(request: RAGQuery):
+    """Query the knowledge base using RAG"""
+    try:
+        # Generate query embedding
+        query_embedding = await embed_text(request.query)
+        
+        cached = llm_cache.lookup("rag", query_embedding)
+        generation = llm_cache.generation("rag")
+        if cached is not None:
+            # The hit may be for a near-identical query; echo this caller's text
+            return cached.model_copy(update={"query": request.query})
+        
+        retrieved_articles = await retrieve_kb_articles(query_embedding)
         
-        completion = groq_client.chat.completions.create(
+        # Generate answer using Groq with retrieved context
+        prompt = build_rag_prompt(request.query, retrieved_articles)
+        
+        completion = await groq_client.chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.4,
@@ -408,21 +684,64 @@ Respond in JSON format:
         response_text = completion.choices[0].message.content
         
         # Parse JSON response
-        import re
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            return RAGResponse(
+        result = parse_llm_json(response_text)
+        response = RAGResponse(
+            query=request.query,
+            retrieved_articles=retrieved_articles,
+            answer=result["answer"],
+            confidence=result["confidence"]
+        )
+        llm_cache.insert("rag", query_embedding, response, generation)
+        return response
+            
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/rag/query/stream")
+async def rag_query_stream(request: RAGQuery):
+    """Query the knowledge base using RAG, streaming LLM tokens as server-sent events.
+
+    Emits an "articles" event with the retrieved articles, a "delta" data
+    event per token chunk, then a "result" event with the parsed RAGResponse
+    (or an "error" event if parsing fails).
+    """
+    try:
+        query_embedding = await embed_text(request.query)
+        
+        cached = llm_cache.lookup("rag", query_embedding)
+        generation = llm_cache.generation("rag")
+        if cached is not None:
+            cached = cached.model_copy(update={"query": request.query})
+        retrieved_articles = None if cached is not None else await retrieve_kb_articles(query_embedding)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        if cached is not None:
+            yield sse_event(cached.model_dump(), event="result")
+            return
+        yield sse_event({"retrieved_articles": retrieved_articles}, event="articles")
+        try:
+            chunks = []
+            prompt = build_rag_prompt(request.query, retrieved_articles)
+            messages = [{"role": "user", "content": prompt}]
+            async for delta in stream_completion(messages, temperature=0.4, max_tokens=500):
+                chunks.append(delta)
+                yield sse_event({"delta": delta})
+            result = parse_llm_json("".join(chunks))
+            response = RAGResponse(
                 query=request.query,
                 retrieved_articles=retrieved_articles,
                 answer=result["answer"],
                 confidence=result["confidence"]
             )
-        else:
-            raise HTTPException(status_code=500, detail="Failed to parse LLM response")
-            
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            yield sse_event({"detail": getattr(e, "detail", str(e))}, event="error")
+            return
+        llm_cache.insert("rag", query_embedding, response, generation)
+        yield sse_event(response.model_dump(), event="result")
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 @api_router.post("/kb/initialize-sample")
 async def initialize_sample_kb():
@@ -547,14 +866,21 @@ async def initialize_sample_kb():
             )
         ]
         
-        # Add embeddings and insert
+        # Add embeddings (one batched forward pass) and insert
         model = get_embedding_model()
-        for article in sample_articles:
+        texts = [f"{article.title}. {article.content}" for article in sample_articles]
+        embeddings = await asyncio.to_thread(
+            model.encode, texts, batch_size=32, normalize_embeddings=True, convert_to_numpy=True
+        )
+        docs = []
+        for article, embedding in zip(sample_articles, embeddings):
             article_dict = article.model_dump()
-            text_to_embed = f"{article.title}. {article.content}"
-            embedding = model.encode(text_to_embed).tolist()
-            article_dict['embedding'] = embedding
-            await db.kb_articles.insert_one(article_dict)
+            article_dict['embedding'] = embedding.tolist()
+            docs.append(article_dict)
+        async with _kb_cache_lock:
+            await db.kb_articles.insert_many(docs, ordered=False)
+            invalidate_kb_cache()
+        llm_cache.invalidate("rag")
         
         return {"message": f"Initialized {len(sample_articles)} sample KB articles"}
     except Exception as e:
@@ -572,7 +898,10 @@ async def reset_database():
     try:
         await db.emails.delete_many({})
         await db.patterns.delete_many({})
-        await db.kb_articles.delete_many({})
+        async with _kb_cache_lock:
+            await db.kb_articles.delete_many({})
+            invalidate_kb_cache()
+        llm_cache.invalidate()
         return {"message": "Database reset successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -595,6 +924,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def load_embedding_model():
+    # Load and warm up the model before serving so the first request doesn't pay for it
+    model = await asyncio.to_thread(get_embedding_model)
+    await asyncio.to_thread(model.encode, ["warmup"])
+
+@app.on_event("startup")
+async def create_indexes():
+    # Indexes backing the per-customer email and pattern lookups
+    await db.emails.create_index("customer_id")
+    try:
+        await db.emails.create_index("email_id", unique=True)
+    except OperationFailure as e:
+        logger.warning(f"Could not create unique email_id index (existing duplicates?): {e}")
+    await db.emails.create_index([("customer_id", 1), ("tag", 1)])
+    await db.patterns.create_index([("customer_id", 1), ("pattern_type", 1)])
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    await groq_client.close()
\ No newline at end of file